@@ -1,10 +1,15 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 from functools import wraps
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, DataError, IntegrityError
 import hashlib
+import math
 import os
-from datetime import datetime, date
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, date, timezone
 
 app = Flask(__name__)
 app.secret_key = 'fleetflow_secret_key_2024'
@@ -666,5 +671,304 @@ def api_vehicle_capacity(vid):
             return jsonify({'max_capacity': v['max_capacity']})
     return jsonify({'max_capacity': 0})
 
+# ==================== TELEMATICS INGESTION ====================
+
+TELEMATICS_MAX_BATCH      = 5000     # readings accepted per request
+TELEMATICS_QUEUE_SIZE     = 100000   # readings buffered before the API pushes back
+TELEMATICS_FLUSH_SIZE     = 2000     # readings written per flush
+TELEMATICS_FLUSH_INTERVAL = 1.0      # seconds a reading may wait before it is written
+TELEMATICS_FLUSH_RETRIES  = 3        # attempts for a single reading that keeps failing
+TELEMATICS_MAX_BACKOFF    = 30       # seconds between retries while the database is down
+TELEMATICS_KEY_TTL        = 60       # seconds a device API key lookup is cached
+DECIMAL_10_2_MAX          = 99999999.99
+
+telematics_queue = queue.Queue(maxsize=TELEMATICS_QUEUE_SIZE)
+_telematics_writer = None
+_telematics_lock = threading.Lock()
+_device_cache = {}
+
+class TelematicsUnavailable(Exception):
+    """The database could not be reached to authenticate a device."""
+
+def get_telematics_device():
+    """Look up the active device for the request's bearer API key.
+
+    The device may report only for its assigned vehicle or, if it has none,
+    for the vehicles listed for it in telematics_device_vehicles. Returns None
+    for a missing or unknown key and raises TelematicsUnavailable if the
+    database cannot be reached.
+    """
+    auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    key_hash = hash_password(auth[len('Bearer '):].strip())
+    cached = _device_cache.get(key_hash)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    conn = get_db()
+    if not conn:
+        raise TelematicsUnavailable()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT device_id, vehicle_id FROM telematics_devices WHERE api_key=%s AND active=1", (key_hash,))
+        device = cursor.fetchone()
+        if device:
+            if device['vehicle_id'] is not None:
+                cursor.execute("SELECT id, license_plate FROM vehicles WHERE id=%s", (device['vehicle_id'],))
+            else:
+                cursor.execute("""SELECT v.id, v.license_plate FROM telematics_device_vehicles dv
+                                 JOIN vehicles v ON dv.vehicle_id=v.id WHERE dv.device_id=%s""", (device['device_id'],))
+            device['vehicles'] = {row['id']: row['license_plate'] for row in cursor.fetchall()}
+            _device_cache[key_hash] = (device, time.monotonic() + TELEMATICS_KEY_TTL)
+    except Error as e:
+        print(f"Telematics device lookup error: {e}")
+        raise TelematicsUnavailable()
+    finally:
+        conn.close()
+    return device
+
+def telematics_unavailable_response(message):
+    resp = jsonify({'error': message})
+    resp.headers['Retry-After'] = '5'
+    return resp, 503
+
+def device_required(f):
+    """Decorator for telematics endpoints, authenticated by device API key instead of session."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        try:
+            device = get_telematics_device()
+        except TelematicsUnavailable:
+            return telematics_unavailable_response('Database unavailable. Retry the batch later.')
+        if not device:
+            return jsonify({'error': 'Invalid or missing device API key.'}), 401
+        g.device = device
+        return f(*args, **kwargs)
+    return decorated
+
+def parse_number(value, field, low, high):
+    """Parse a finite number within [low, high], raising ValueError otherwise."""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'{field} must be a number')
+    try:
+        number = float(value)
+    except (ValueError, OverflowError):
+        raise ValueError(f'{field} must be a number')
+    if not math.isfinite(number):
+        raise ValueError(f'{field} must be a finite number')
+    if not low <= number <= high:
+        raise ValueError(f'{field} must be between {low} and {high}')
+    return number
+
+def parse_reading_time(value):
+    """Parse an ISO-8601 string or epoch seconds into a naive UTC datetime."""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError('timestamp must be ISO-8601 or epoch seconds')
+    if isinstance(value, str):
+        try:
+            ts = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('timestamp must be ISO-8601 or epoch seconds')
+        if ts.tzinfo:
+            try:
+                ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+            except (ValueError, OverflowError):
+                raise ValueError('timestamp is out of range')
+    else:
+        try:
+            ts = datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+        except (ValueError, OverflowError, OSError):
+            raise ValueError('timestamp is out of range')
+    if ts.year < 1970:
+        raise ValueError('timestamp is out of range')
+    return ts
+
+def resolve_reading_vehicle(raw, device):
+    """Return the vehicle id a reading is for, if the device may report for it."""
+    allowed = device['vehicles']
+    vehicle_id = raw.get('vehicle_id')
+    plate = raw.get('license_plate')
+    if vehicle_id is not None and (isinstance(vehicle_id, bool) or not isinstance(vehicle_id, int)):
+        raise ValueError('vehicle_id must be an integer')
+    if plate is not None:
+        if not isinstance(plate, str) or not plate.strip():
+            raise ValueError('license_plate must be a non-empty string')
+        plate_id = next((vid for vid, p in allowed.items() if p.upper() == plate.strip().upper()), None)
+        if plate_id is None or (vehicle_id is not None and vehicle_id != plate_id):
+            raise ValueError(f'device is not allowed to report for {plate}')
+        vehicle_id = plate_id
+    if vehicle_id is None:
+        vehicle_id = device['vehicle_id']
+        if vehicle_id is None:
+            raise ValueError('vehicle_id or license_plate is required')
+    if vehicle_id not in allowed:
+        raise ValueError(f'device is not allowed to report for vehicle {vehicle_id}')
+    return vehicle_id
+
+def parse_reading(raw, device):
+    if not isinstance(raw, dict):
+        raise ValueError('reading must be an object')
+    vehicle_id = resolve_reading_vehicle(raw, device)
+    if raw.get('timestamp') is None:
+        raise ValueError('timestamp is required')
+    if raw.get('odometer') is None:
+        raise ValueError('odometer is required')
+    odometer = parse_number(raw['odometer'], 'odometer', 0, DECIMAL_10_2_MAX)
+    fuel_level = raw.get('fuel_level')
+    if fuel_level is not None:
+        fuel_level = parse_number(fuel_level, 'fuel_level', 0, 100)
+    fill = raw.get('fill')
+    fill_liters = fill_cost = None
+    if fill is not None:
+        if not isinstance(fill, dict):
+            raise ValueError('fill must be an object')
+        if fill.get('liters') is None:
+            raise ValueError('fill.liters is required')
+        fill_liters = parse_number(fill['liters'], 'fill.liters', 0.01, DECIMAL_10_2_MAX)
+        if fill.get('cost') is not None:
+            fill_cost = parse_number(fill['cost'], 'fill.cost', 0, DECIMAL_10_2_MAX)
+    return {
+        'device_id':   device['device_id'],
+        'vehicle_id':  vehicle_id,
+        'recorded_at': parse_reading_time(raw['timestamp']),
+        'odometer':    odometer,
+        'fuel_level':  fuel_level,
+        'fill_liters': fill_liters,
+        'fill_cost':   fill_cost,
+    }
+
+def start_telematics_writer():
+    global _telematics_writer
+    with _telematics_lock:
+        if _telematics_writer is None or not _telematics_writer.is_alive():
+            _telematics_writer = threading.Thread(target=telematics_writer_loop,
+                                                  name='telematics-writer', daemon=True)
+            _telematics_writer.start()
+
+def telematics_writer_loop():
+    while True:
+        write_telematics(next_telematics_batch())
+
+def next_telematics_batch():
+    """Block for one reading, then collect more until TELEMATICS_FLUSH_SIZE or TELEMATICS_FLUSH_INTERVAL."""
+    batch = [telematics_queue.get()]
+    deadline = time.monotonic() + TELEMATICS_FLUSH_INTERVAL
+    while len(batch) < TELEMATICS_FLUSH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(telematics_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def write_telematics(batch):
+    """Write a batch, halving it on errors so one bad reading cannot sink the rest.
+
+    While the database is unreachable the batch is retried with capped backoff
+    and nothing is dropped; the queue fills and the API answers 503 instead.
+    A single reading that fails on its own is dropped: at once for data and
+    integrity errors, otherwise after TELEMATICS_FLUSH_RETRIES attempts.
+    """
+    attempts, backoff = 0, 1
+    while True:
+        try:
+            if flush_telematics(batch):
+                return
+        except Exception as e:
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                write_telematics(batch[:mid])
+                write_telematics(batch[mid:])
+                return
+            attempts += 1
+            retryable = isinstance(e, Error) and not isinstance(e, (DataError, IntegrityError))
+            if not retryable or attempts >= TELEMATICS_FLUSH_RETRIES:
+                log_dropped_readings(batch, e)
+                return
+            print(f"Telematics flush error (attempt {attempts}): {e}")
+            time.sleep(attempts)
+            continue
+        print(f"Telematics: database unavailable, retrying {len(batch)} readings in {backoff}s")
+        time.sleep(backoff)
+        backoff = min(backoff * 2, TELEMATICS_MAX_BACKOFF)
+
+def log_dropped_readings(batch, error):
+    devices = sorted({r['device_id'] for r in batch})
+    times = [r['recorded_at'] for r in batch]
+    print(f"Telematics: dropped {len(batch)} readings from {', '.join(devices)} "
+          f"({min(times).isoformat()} to {max(times).isoformat()}): {error}")
+
+def flush_telematics(batch):
+    """Write a batch of readings using a fixed handful of bulk statements.
+
+    Duplicate (device_id, recorded_at) readings are skipped by the unique key, and
+    only readings new to this batch produce fuel logs or move a vehicle's odometer.
+    """
+    conn = get_db()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        ids = sorted({r['vehicle_id'] for r in batch})
+        cursor.execute("SELECT id FROM vehicles WHERE id IN (%s)" % ','.join(['%s'] * len(ids)), ids)
+        known_ids = {row[0] for row in cursor.fetchall()}
+
+        batch_id = uuid.uuid4().hex
+        rows = [(batch_id, r['device_id'], r['vehicle_id'], r['recorded_at'], r['odometer'],
+                 r['fuel_level'], r['fill_liters'], r['fill_cost'])
+                for r in batch if r['vehicle_id'] in known_ids]
+        if len(rows) < len(batch):
+            print(f"Telematics: skipped {len(batch) - len(rows)} readings for deleted vehicles")
+        if rows:
+            cursor.executemany("""INSERT INTO telematics_readings
+                                 (batch_id, device_id, vehicle_id, recorded_at, odometer, fuel_level, fill_liters, fill_cost)
+                                 VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                                 ON DUPLICATE KEY UPDATE id=id""", rows)
+            cursor.execute("""INSERT INTO fuel_logs (vehicle_id, liters, cost, odometer_reading, log_date, notes)
+                             SELECT vehicle_id, fill_liters, COALESCE(fill_cost, 0), odometer, DATE(recorded_at),
+                                    CONCAT('Telematics fill (', device_id, ')')
+                             FROM telematics_readings WHERE batch_id=%s AND fill_liters IS NOT NULL""", (batch_id,))
+            cursor.execute("""UPDATE vehicles v
+                             JOIN (SELECT vehicle_id, MAX(odometer) as odometer FROM telematics_readings
+                                   WHERE batch_id=%s GROUP BY vehicle_id) r ON r.vehicle_id=v.id
+                             SET v.odometer=GREATEST(COALESCE(v.odometer, 0), r.odometer)""", (batch_id,))
+            conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return True
+
+@app.route('/api/telematics/readings', methods=['POST'])
+@device_required
+def api_telematics_readings():
+    payload = request.get_json(silent=True)
+    raw_readings = payload.get('readings') if isinstance(payload, dict) else payload
+    if not isinstance(raw_readings, list):
+        return jsonify({'error': 'Expected a JSON list of readings.'}), 400
+    if len(raw_readings) > TELEMATICS_MAX_BATCH:
+        return jsonify({'error': f'At most {TELEMATICS_MAX_BATCH} readings per request.'}), 413
+
+    readings, rejected = [], []
+    for i, raw in enumerate(raw_readings):
+        try:
+            readings.append(parse_reading(raw, g.device))
+        except ValueError as e:
+            rejected.append({'index': i, 'error': str(e)})
+
+    start_telematics_writer()
+    for reading in readings:
+        try:
+            telematics_queue.put_nowait(reading)
+        except queue.Full:
+            # Nothing here has been acknowledged yet and writes are deduplicated,
+            # so the client can resend the whole batch.
+            return telematics_unavailable_response('Ingestion queue is full. Retry the batch later.')
+    # 202 is at-most-once: queued readings live only in memory until flushed.
+    return jsonify({'accepted': len(readings), 'rejected': rejected}), 202
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -87,6 +87,43 @@ CREATE TABLE IF NOT EXISTS fuel_logs (
     FOREIGN KEY (trip_id) REFERENCES trips(id) ON DELETE SET NULL
 );
 
+-- Telematics devices (api_key = SHA256 of the device's key)
+CREATE TABLE IF NOT EXISTS telematics_devices (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    device_id VARCHAR(64) UNIQUE NOT NULL,
+    api_key VARCHAR(256) UNIQUE NOT NULL,
+    vehicle_id INT DEFAULT NULL COMMENT 'the only vehicle this device may report for',
+    active TINYINT(1) DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (vehicle_id) REFERENCES vehicles(id) ON DELETE SET NULL
+);
+
+-- Vehicles a telematics device with no assigned vehicle may report for
+CREATE TABLE IF NOT EXISTS telematics_device_vehicles (
+    device_id VARCHAR(64) NOT NULL,
+    vehicle_id INT NOT NULL,
+    PRIMARY KEY (device_id, vehicle_id),
+    FOREIGN KEY (device_id) REFERENCES telematics_devices(device_id) ON DELETE CASCADE,
+    FOREIGN KEY (vehicle_id) REFERENCES vehicles(id) ON DELETE CASCADE
+);
+
+-- Telematics readings (one row per device per timestamp)
+CREATE TABLE IF NOT EXISTS telematics_readings (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    batch_id CHAR(32) NOT NULL,
+    device_id VARCHAR(64) NOT NULL,
+    vehicle_id INT NOT NULL,
+    recorded_at DATETIME(3) NOT NULL COMMENT 'UTC',
+    odometer DECIMAL(10,2) NOT NULL COMMENT 'in km',
+    fuel_level DECIMAL(5,2) DEFAULT NULL COMMENT 'in %',
+    fill_liters DECIMAL(10,2) DEFAULT NULL,
+    fill_cost DECIMAL(10,2) DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_device_time (device_id, recorded_at),
+    KEY idx_batch (batch_id),
+    FOREIGN KEY (vehicle_id) REFERENCES vehicles(id) ON DELETE CASCADE
+);
+
 -- ===================== SEED DATA =====================
 
 -- Default users (password = "admin123" hashed)
@@ -137,3 +174,7 @@ INSERT IGNORE INTO fuel_logs (vehicle_id, trip_id, liters, cost, odometer_readin
 (3, 3, 45, 4050, 23400, DATE_SUB(CURDATE(), INTERVAL 8 DAY), ''),
 (6, 4, 8, 720, 5600, DATE_SUB(CURDATE(), INTERVAL 2 DAY), 'City delivery run'),
 (4, 1, 65, 5850, 15600, CURDATE(), 'Dispatched today');
+
+-- Sample telematics device (API key = "telematics123" hashed)
+INSERT IGNORE INTO telematics_devices (device_id, api_key, vehicle_id) VALUES
+('TEL-TRK-001', '6b3dee7822773641d25792ae22ee4595b7d7a292ba5bfd5fb718afefe9aea170', 1);
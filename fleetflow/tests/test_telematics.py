@@ -0,0 +1,378 @@
+"""Telematics parsing, endpoint and writer tests. No MySQL server is needed."""
+import queue
+import time
+from datetime import datetime
+
+import pytest
+
+import app as fleetflow
+
+TRUCK = {'device_id': 'TEL-TRK-001', 'vehicle_id': 1, 'vehicles': {1: 'TRK-001-AB'}}
+GATEWAY = {'device_id': 'TEL-GW-001', 'vehicle_id': None, 'vehicles': {3: 'VAN-001-EF', 5: 'VAN-003-IJ'}}
+
+
+def reading(**overrides):
+    raw = {'timestamp': '2026-10-19T08:00:00Z', 'odometer': 45250.4}
+    raw.update(overrides)
+    return raw
+
+
+# ---------- parse_reading_time ----------
+
+@pytest.mark.parametrize('value, expected', [
+    ('2026-10-19T08:00:00.123Z', datetime(2026, 10, 19, 8, 0, 0, 123000)),
+    ('2026-10-19T13:30:00+05:30', datetime(2026, 10, 19, 8, 0)),
+    ('2026-10-19T08:00:00', datetime(2026, 10, 19, 8, 0)),
+    (1760860800, datetime(2025, 10, 19, 8, 0)),
+    (1760860800.5, datetime(2025, 10, 19, 8, 0, 0, 500000)),
+])
+def test_parse_reading_time(value, expected):
+    assert fleetflow.parse_reading_time(value) == expected
+
+
+@pytest.mark.parametrize('value', [
+    True, None, ['2026-10-19'], {'ts': 1}, 'yesterday', '0001-01-01T00:00:00',
+    -1, float('inf'), float('nan'), 1e400, 10 ** 30,
+    '0001-01-01T00:00:00+05:00', '9999-12-31T23:00:00-05:00',
+])
+def test_parse_reading_time_rejects(value):
+    with pytest.raises(ValueError):
+        fleetflow.parse_reading_time(value)
+
+
+# ---------- parse_reading ----------
+
+def test_parse_reading_defaults_to_assigned_vehicle():
+    parsed = fleetflow.parse_reading(reading(fuel_level=62, fill={'liters': 40, 'cost': 3600}), TRUCK)
+    assert parsed == {
+        'device_id': 'TEL-TRK-001', 'vehicle_id': 1,
+        'recorded_at': datetime(2026, 10, 19, 8, 0), 'odometer': 45250.4,
+        'fuel_level': 62.0, 'fill_liters': 40.0, 'fill_cost': 3600.0,
+    }
+
+
+def test_parse_reading_resolves_plate_case_insensitively():
+    assert fleetflow.parse_reading(reading(license_plate=' trk-001-ab '), TRUCK)['vehicle_id'] == 1
+
+
+def test_parse_reading_allow_list_device():
+    assert fleetflow.parse_reading(reading(vehicle_id=5), GATEWAY)['vehicle_id'] == 5
+    assert fleetflow.parse_reading(reading(license_plate='VAN-001-EF'), GATEWAY)['vehicle_id'] == 3
+
+
+@pytest.mark.parametrize('device, overrides', [
+    (TRUCK, {'vehicle_id': 3}),
+    (TRUCK, {'license_plate': 'VAN-001-EF'}),
+    (TRUCK, {'vehicle_id': 1, 'license_plate': 'VAN-001-EF'}),
+    (GATEWAY, {'vehicle_id': 1}),
+    (GATEWAY, {}),
+])
+def test_parse_reading_rejects_vehicles_outside_device_scope(device, overrides):
+    with pytest.raises(ValueError):
+        fleetflow.parse_reading(reading(**overrides), device)
+
+
+@pytest.mark.parametrize('overrides', [
+    {'license_plate': ['x']},
+    {'license_plate': 42},
+    {'license_plate': '  '},
+    {'vehicle_id': '1'},
+    {'vehicle_id': True},
+    {'vehicle_id': 1.0},
+])
+def test_parse_reading_rejects_bad_vehicle_types(overrides):
+    with pytest.raises(ValueError):
+        fleetflow.parse_reading(reading(**overrides), TRUCK)
+
+
+@pytest.mark.parametrize('overrides', [
+    {'timestamp': None},
+    {'odometer': None},
+    {'odometer': float('inf')},
+    {'odometer': float('nan')},
+    {'odometer': 'inf'},
+    {'odometer': 1e400},
+    {'odometer': 10 ** 400},
+    {'odometer': 100000000},
+    {'odometer': -1},
+    {'odometer': True},
+    {'odometer': [1]},
+    {'fuel_level': 101},
+    {'fuel_level': -0.5},
+    {'fuel_level': float('nan')},
+    {'fill': {'liters': 0}},
+    {'fill': {'cost': 10}},
+    {'fill': {'liters': float('inf')}},
+    {'fill': {'liters': 40, 'cost': -3600}},
+    {'fill': {'liters': 40, 'cost': float('nan')}},
+    {'fill': [40]},
+])
+def test_parse_reading_rejects_bad_values(overrides):
+    with pytest.raises(ValueError):
+        fleetflow.parse_reading(reading(**overrides), TRUCK)
+
+
+def test_parse_reading_accepts_bounds():
+    parsed = fleetflow.parse_reading(reading(odometer=fleetflow.DECIMAL_10_2_MAX, fuel_level=100,
+                                             fill={'liters': '0.01', 'cost': 0}), TRUCK)
+    assert parsed['odometer'] == fleetflow.DECIMAL_10_2_MAX
+    assert parsed['fill_cost'] == 0.0
+
+
+# ---------- endpoint ----------
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(fleetflow, 'get_telematics_device', lambda: TRUCK)
+    monkeypatch.setattr(fleetflow, 'start_telematics_writer', lambda: None)
+    monkeypatch.setattr(fleetflow, 'telematics_queue', queue.Queue(maxsize=3))
+    return fleetflow.app.test_client()
+
+
+def test_endpoint_rejects_bad_readings_by_index(client):
+    resp = client.post('/api/telematics/readings', json={'readings': [
+        reading(),
+        {'license_plate': ['x'], 'timestamp': 1, 'odometer': 1},
+        reading(odometer=float('inf')),
+        reading(timestamp='2026-10-19T08:00:01Z', vehicle_id=3),
+    ]})
+    assert resp.status_code == 202
+    body = resp.get_json()
+    assert body['accepted'] == 1
+    assert [r['index'] for r in body['rejected']] == [1, 2, 3]
+    assert fleetflow.telematics_queue.qsize() == 1
+
+
+def test_endpoint_rejects_out_of_range_offset_timestamp(client):
+    resp = client.post('/api/telematics/readings', json=[
+        reading(), reading(timestamp='0001-01-01T00:00:00+05:00'),
+    ])
+    assert resp.status_code == 202
+    body = resp.get_json()
+    assert body['accepted'] == 1
+    assert [r['index'] for r in body['rejected']] == [1]
+
+
+def test_endpoint_returns_503_when_queue_full(client):
+    resp = client.post('/api/telematics/readings', json=[reading(timestamp=i) for i in range(4)])
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '5'
+
+
+def test_endpoint_requires_api_key():
+    resp = fleetflow.app.test_client().post('/api/telematics/readings', json=[reading()])
+    assert resp.status_code == 401
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def execute(self, sql, params=()):
+        self.conn.record(sql, params)
+        if sql.startswith('SELECT id FROM vehicles'):
+            self.result = [(vid,) for vid in params if vid in self.conn.vehicle_ids]
+
+    def executemany(self, sql, rows):
+        self.conn.record(sql, rows)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeConnection:
+    def __init__(self, vehicle_ids=(), fail_on=None):
+        self.vehicle_ids = set(vehicle_ids)
+        self.fail_on = fail_on
+        self.statements = []
+        self.committed = self.rolled_back = self.closed = False
+
+    def record(self, sql, params):
+        if self.fail_on and self.fail_on in sql:
+            raise fleetflow.Error('simulated failure')
+        self.statements.append((' '.join(sql.split()), params))
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+
+# ---------- device lookup ----------
+
+def test_device_lookup_returns_503_when_database_unavailable(monkeypatch):
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: None)
+    resp = fleetflow.app.test_client().post('/api/telematics/readings', json=[reading()],
+                                            headers={'Authorization': 'Bearer no-db-key'})
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '5'
+
+
+def test_device_lookup_closes_connection_on_query_error(monkeypatch):
+    conn = FakeConnection(fail_on='telematics_devices')
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: conn)
+    resp = fleetflow.app.test_client().post('/api/telematics/readings', json=[reading()],
+                                            headers={'Authorization': 'Bearer query-error-key'})
+    assert resp.status_code == 503
+    assert conn.closed
+
+
+def test_device_lookup_returns_401_for_unknown_key(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: conn)
+    resp = fleetflow.app.test_client().post('/api/telematics/readings', json=[reading()],
+                                            headers={'Authorization': 'Bearer unknown-key'})
+    assert resp.status_code == 401
+    assert conn.closed
+
+
+# ---------- flush ----------
+
+def make_batch(count, vehicle_id=1):
+    return [dict(fleetflow.parse_reading(reading(timestamp=i, odometer=i), TRUCK), vehicle_id=vehicle_id)
+            for i in range(count)]
+
+
+@pytest.mark.parametrize('size', [1, 500])
+def test_flush_runs_fixed_statements_per_batch(monkeypatch, size):
+    conn = FakeConnection(vehicle_ids={1})
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: conn)
+    assert fleetflow.flush_telematics(make_batch(size))
+
+    kinds = [sql.split(' (')[0].split(' WHERE')[0] for sql, _ in conn.statements]
+    assert kinds == ['SELECT id FROM vehicles', 'INSERT INTO telematics_readings',
+                     'INSERT INTO fuel_logs', 'UPDATE vehicles v JOIN']
+    insert_sql, rows = conn.statements[1]
+    assert insert_sql.endswith('ON DUPLICATE KEY UPDATE id=id')
+    assert len(rows) == size
+    batch_id = rows[0][0]
+    assert conn.statements[2][1] == (batch_id,)
+    assert conn.statements[3][1] == (batch_id,)
+    assert 'GREATEST' in conn.statements[3][0]
+    assert conn.committed and conn.closed and not conn.rolled_back
+
+
+def test_flush_skips_readings_for_unknown_vehicles(monkeypatch):
+    conn = FakeConnection(vehicle_ids={1})
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: conn)
+    fleetflow.flush_telematics(make_batch(3, vehicle_id=1) + make_batch(2, vehicle_id=99))
+    assert conn.statements[0][1] == [1, 99]
+    rows = conn.statements[1][1]
+    assert [row[2] for row in rows] == [1, 1, 1]
+
+
+def test_flush_with_only_unknown_vehicles_writes_nothing(monkeypatch):
+    conn = FakeConnection(vehicle_ids=set())
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: conn)
+    assert fleetflow.flush_telematics(make_batch(2, vehicle_id=99))
+    assert len(conn.statements) == 1
+    assert not conn.committed and conn.closed
+
+
+def test_flush_rolls_back_on_error(monkeypatch):
+    conn = FakeConnection(vehicle_ids={1}, fail_on='UPDATE vehicles')
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: conn)
+    with pytest.raises(fleetflow.Error):
+        fleetflow.flush_telematics(make_batch(5))
+    assert conn.rolled_back and conn.closed and not conn.committed
+
+
+def test_flush_returns_false_without_database(monkeypatch):
+    monkeypatch.setattr(fleetflow, 'get_db', lambda: None)
+    assert fleetflow.flush_telematics(make_batch(1)) is False
+
+
+# ---------- batching ----------
+
+def test_next_batch_stops_at_flush_size(monkeypatch):
+    q = queue.Queue()
+    for i in range(7):
+        q.put(i)
+    monkeypatch.setattr(fleetflow, 'telematics_queue', q)
+    monkeypatch.setattr(fleetflow, 'TELEMATICS_FLUSH_SIZE', 5)
+    assert fleetflow.next_telematics_batch() == [0, 1, 2, 3, 4]
+    assert q.qsize() == 2
+
+
+def test_next_batch_stops_at_flush_interval(monkeypatch):
+    q = queue.Queue()
+    for i in range(3):
+        q.put(i)
+    monkeypatch.setattr(fleetflow, 'telematics_queue', q)
+    monkeypatch.setattr(fleetflow, 'TELEMATICS_FLUSH_INTERVAL', 0.05)
+    started = time.monotonic()
+    assert fleetflow.next_telematics_batch() == [0, 1, 2]
+    assert 0.04 <= time.monotonic() - started < 1
+
+
+# ---------- writer ----------
+
+def test_write_telematics_isolates_failing_reading(monkeypatch):
+    """One unwritable reading is split out and dropped; the rest of the batch is written."""
+    written = []
+
+    def flush(batch):
+        if any(r['odometer'] == 13 for r in batch):
+            raise fleetflow.Error('poisoned row')
+        written.extend(batch)
+        return True
+
+    monkeypatch.setattr(fleetflow, 'flush_telematics', flush)
+    monkeypatch.setattr(fleetflow.time, 'sleep', lambda seconds: None)
+    batch = [fleetflow.parse_reading(reading(timestamp=i, odometer=i), TRUCK) for i in range(100)]
+    fleetflow.write_telematics(batch)
+    assert sorted(r['odometer'] for r in written) == [i for i in range(100) if i != 13]
+
+
+def test_write_telematics_keeps_retrying_while_database_unavailable(monkeypatch):
+    attempts, sleeps = [], []
+
+    def flush(batch):
+        attempts.append(len(batch))
+        return len(attempts) == 10
+
+    monkeypatch.setattr(fleetflow, 'flush_telematics', flush)
+    monkeypatch.setattr(fleetflow.time, 'sleep', sleeps.append)
+    fleetflow.write_telematics(make_batch(10))
+    assert attempts == [10] * 10
+    assert sleeps == [1, 2, 4, 8, 16, 30, 30, 30, 30]
+
+
+def test_write_telematics_drops_data_error_immediately(monkeypatch, capsys):
+    calls, sleeps = [], []
+
+    def flush(batch):
+        calls.append(len(batch))
+        raise fleetflow.DataError('out of range')
+
+    monkeypatch.setattr(fleetflow, 'flush_telematics', flush)
+    monkeypatch.setattr(fleetflow.time, 'sleep', sleeps.append)
+    fleetflow.write_telematics(make_batch(1))
+    assert calls == [1] and sleeps == []
+    assert 'dropped 1 readings from TEL-TRK-001 (1970-01-01T00:00:00 to 1970-01-01T00:00:00)' in capsys.readouterr().out
+
+
+def test_write_telematics_does_not_sleep_after_last_attempt(monkeypatch, capsys):
+    calls, sleeps = [], []
+
+    def flush(batch):
+        calls.append(len(batch))
+        raise fleetflow.Error('lock wait timeout')
+
+    monkeypatch.setattr(fleetflow, 'flush_telematics', flush)
+    monkeypatch.setattr(fleetflow.time, 'sleep', sleeps.append)
+    fleetflow.write_telematics(make_batch(1))
+    assert calls == [1] * fleetflow.TELEMATICS_FLUSH_RETRIES
+    assert sleeps == [1, 2]
+    assert "'device_id'" not in capsys.readouterr().out